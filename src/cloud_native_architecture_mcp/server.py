@@ -12,57 +12,471 @@ Uses Diagrams library (diagrams.mingrammer.com) to create visual architecture di
 
 import asyncio
 import json
-from typing import Any
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from typing import Any, ClassVar, Literal, NamedTuple, get_args
 from mcp.server import Server
-from mcp.types import Tool, TextContent, ImageContent, EmbeddedResource
-from pydantic import AnyUrl
+from mcp.types import Tool, TextContent, ImageContent, EmbeddedResource, TextResourceContents
+from pydantic import BaseModel, Field, model_validator
 import mcp.server.stdio
 
-# Import diagrams library
-from diagrams import Diagram, Cluster, Edge
-from diagrams.k8s.clusterconfig import HPA
-from diagrams.k8s.compute import Deployment, Pod, ReplicaSet, StatefulSet, DaemonSet, Job
-from diagrams.k8s.network import Ingress, Service
-from diagrams.k8s.storage import PV, PVC, StorageClass
-from diagrams.k8s.podconfig import ConfigMap, Secret
-from diagrams.aws.compute import EC2, ECS, EKS, Lambda
-from diagrams.aws.database import RDS, Dynamodb, Elasticache, Redshift
-from diagrams.aws.network import ELB, ALB, NLB, CloudFront, Route53, VPC
-from diagrams.aws.storage import S3, EBS, EFS
-from diagrams.aws.integration import SQS, SNS, Eventbridge
-from diagrams.gcp.compute import GCE, GKE, ComputeEngine, Functions
-from diagrams.gcp.database import SQL, Firestore, BigTable, Spanner
-from diagrams.gcp.network import LoadBalancing, DNS, VPC as GCP_VPC
-from diagrams.gcp.storage import GCS, PersistentDisk
-from diagrams.gcp.analytics import BigQuery, Dataflow, Pubsub
+# Import diagrams library; provider modules are imported lazily on first use. Only the
+# class attributes (icons, default styles) are used; DOT source is emitted directly.
+import diagrams
+from diagrams import Diagram, Cluster, Edge, Node
+import graphviz
+from graphviz.quoting import nohtml, quote
 
 import os
-import base64
+from base64 import b64encode
+import functools
+import hashlib
+import html
+import importlib.metadata
+import re
+import shutil
+import stat
+import struct
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:  # Fall back to the stdlib encoder
+    orjson = None
+
 
 # Create MCP server instance
 server = Server("cloud-native-architecture-mcp")
 
-# Diagram output directory
-OUTPUT_DIR = Path("/tmp/architecture_diagrams")
-OUTPUT_DIR.mkdir(exist_ok=True)
+BATCH_TOOL_NAME = "build-architecture-batch"
+
+# Render cache directory, private to the server's user; created on first use
+OUTPUT_DIR = Path(tempfile.gettempdir()) / (
+    f"architecture_diagrams-{os.getuid()}" if hasattr(os, "getuid") else "architecture_diagrams"
+)
+OUTPUT_DIR_STR = str(OUTPUT_DIR)
+
+# Rendered diagrams kept on disk; the oldest entries are pruned past this many
+CACHE_MAX_ENTRIES = 256
+
+# In-memory copies of cache entries: total size, and largest single entry worth holding
+CACHE_MEMO_MAX_CHARS = 32 * 1024 * 1024
+CACHE_MEMO_MAX_ENTRY_CHARS = 4 * 1024 * 1024
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Renders that may run at once: renderer threads, and dot workers per format
+RENDER_CONCURRENCY = min(8, os.cpu_count() or 1)
+
+# Seconds to wait for a persistent dot worker before falling back to a one-shot render
+DOT_WORKER_TIMEOUT = 60
+
+
+async def _read_png(stream: asyncio.StreamReader) -> bytes:
+    """Read exactly one PNG image off a stream, framed by its own chunk structure."""
+    data = bytearray(await stream.readexactly(len(PNG_SIGNATURE)))
+    if data != PNG_SIGNATURE:
+        raise ValueError("dot worker returned a non-PNG payload")
+    while True:
+        header = await stream.readexactly(8)
+        length, chunk_type = struct.unpack(">I4s", header)
+        data += header
+        data += await stream.readexactly(length + 4)  # chunk data + CRC
+        if chunk_type == b"IEND":
+            return bytes(data)
+
+
+async def _read_svg(stream: asyncio.StreamReader) -> bytes:
+    """Read exactly one SVG document off a stream; dot ends each with a `</svg>` line."""
+    return await stream.readuntil(b"</svg>\n")
+
+
+# Largest single document a dot worker will buffer while looking for the SVG terminator
+DOT_WORKER_BUFFER_LIMIT = 64 * 1024 * 1024
+
+
+class DotWorker:
+    """Long-lived `dot -T<format>` process fed one graph per request over stdin.
+
+    dot renders each graph it reads from stdin in turn, so reusing one process avoids
+    the fork/exec cost of a fresh Graphviz per diagram. Responses are framed by the
+    output format itself: PNG ends with an IEND chunk, SVG with a closing </svg> tag.
+    """
+
+    _readers: ClassVar[dict[str, Callable[[asyncio.StreamReader], Awaitable[bytes]]]] = {
+        "png": _read_png, "svg": _read_svg
+    }
+
+    def __init__(self, fmt: str):
+        self.fmt = fmt
+        self._read = self._readers[fmt]
+        self._proc: asyncio.subprocess.Process | None = None
+        self._lock = asyncio.Lock()
+        self.loop: asyncio.AbstractEventLoop | None = None
+
+    @property
+    def alive(self) -> bool:
+        return self._proc is not None and self._proc.returncode is None
+
+    async def start(self) -> None:
+        """Launch the dot process; leaves the worker dead if Graphviz is unavailable."""
+        self.loop = asyncio.get_running_loop()
+        try:
+            self._proc = await asyncio.create_subprocess_exec(
+                "dot", f"-T{self.fmt}",
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+                limit=DOT_WORKER_BUFFER_LIMIT,
+            )
+        except OSError:
+            self._proc = None
+
+    async def render(self, source: str) -> bytes:
+        """Render DOT source to image bytes. Raises RuntimeError if the worker is unusable.
+
+        A worker retired by an earlier failure is respawned here, on next use.
+        """
+        # Anything but one complete graph would desync the stream for every later render
+        if "\0" in source or not source.endswith("}\n"):
+            raise RuntimeError("not a single complete DOT graph")
+        async with self._lock:
+            if not self.alive:
+                await self.start()
+                if not self.alive:
+                    raise RuntimeError("dot worker is not running")
+            try:
+                self._proc.stdin.write(source.encode("utf-8") + b"\n")
+                await self._proc.stdin.drain()
+                return await asyncio.wait_for(self._read(self._proc.stdout), DOT_WORKER_TIMEOUT)
+            except (
+                OSError, EOFError, ValueError, asyncio.LimitOverrunError, asyncio.TimeoutError
+            ) as e:
+                # The stream is now out of sync; retire this process.
+                self._kill()
+                raise RuntimeError(f"dot worker failed: {e}") from e
+
+    def _kill(self) -> None:
+        if self.alive:
+            self._proc.kill()
+        self._proc = None
+
+    async def close(self) -> None:
+        """Shut the dot process down."""
+        if self.alive:
+            self._proc.stdin.close()
+            try:
+                await asyncio.wait_for(self._proc.wait(), 5)
+            except asyncio.TimeoutError:
+                self._proc.kill()
+        self._proc = None
+
+
+class DotWorkerPool:
+    """A fixed set of DotWorkers for one format, each serving one render at a time.
+
+    Worker processes are spawned on first use, so an idle server runs no more dot
+    processes than it has needed at once.
+    """
+
+    def __init__(self, fmt: str, size: int):
+        self.workers = [DotWorker(fmt) for _ in range(size)]
+        self._idle: asyncio.Queue[DotWorker] | None = None
+        self.loop: asyncio.AbstractEventLoop | None = None
+
+    async def start(self) -> None:
+        """Bind the pool to the running event loop."""
+        self.loop = asyncio.get_running_loop()
+        self._idle = asyncio.Queue()
+        for worker in self.workers:
+            self._idle.put_nowait(worker)
+
+    async def render(self, source: str) -> bytes:
+        """Render DOT source on the next idle worker. Raises RuntimeError on failure."""
+        worker = await self._idle.get()
+        try:
+            return await worker.render(source)
+        finally:
+            self._idle.put_nowait(worker)
+
+    async def close(self) -> None:
+        """Shut every worker's dot process down."""
+        for worker in self.workers:
+            await worker.close()
+
+
+# Persistent workers per rendered output format, one per renderer thread
+dot_pools = {fmt: DotWorkerPool(fmt, RENDER_CONCURRENCY) for fmt in ("png", "svg")}
+
+
+def render_image(source: str, fmt: str) -> bytes:
+    """Render DOT source to PNG/SVG bytes, preferring a persistent dot worker.
+
+    Called from renderer threads; the workers themselves live on the server's event loop.
+    Neither path writes the DOT source or the image to disk.
+    """
+    pool = dot_pools[fmt]
+    if pool.loop is not None:
+        future = asyncio.run_coroutine_threadsafe(pool.render(source), pool.loop)
+        try:
+            return future.result()
+        except RuntimeError:
+            pass
+
+    # Fall back to a one-shot dot invocation, piped through stdout
+    return graphviz.pipe("dot", fmt, source.encode("utf-8"))
 
 
 def parse_component_config(component_str: str) -> dict:
     """Parse component configuration from string format like 'deployment:my-app:3'"""
-    parts = component_str.split(":")
+    comp_type, has_name, rest = component_str.partition(":")
+    name, has_replicas, rest = rest.partition(":")
+    replicas = rest.partition(":")[0]
     return {
-        "type": parts[0] if len(parts) > 0 else "",
-        "name": parts[1] if len(parts) > 1 else "unnamed",
-        "replicas": int(parts[2]) if len(parts) > 2 else 1
+        "type": comp_type,
+        "name": name if has_name else "unnamed",
+        "replicas": int(replicas) if has_replicas else 1
     }
 
 
+def _dist_version(name: str) -> str:
+    """Return an installed distribution's version, or 'unknown' (e.g. run from a checkout)."""
+    try:
+        return importlib.metadata.version(name)
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
+
+
+# Part of every cache key, so upgrading the server or diagrams never serves stale renders
+RENDER_VERSIONS = {
+    "server": _dist_version("cloud-native-architecture-mcp"),
+    "diagrams": _dist_version("diagrams"),
+}
+
+
+def _spec_hash(tool_name: str, arguments: dict) -> str:
+    """Return a stable SHA-256 key for a diagram request (tool name + arguments).
+
+    RENDER_VERSIONS is hashed in too.
+    """
+    spec = {"tool": tool_name, "arguments": arguments, "versions": RENDER_VERSIONS}
+    if orjson is not None:
+        try:
+            return hashlib.sha256(orjson.dumps(spec, option=orjson.OPT_SORT_KEYS)).hexdigest()
+        except orjson.JSONEncodeError:
+            pass  # e.g. integers beyond 64 bits, which the stdlib encoder accepts
+    # Same canonical form orjson produces: sorted keys, no whitespace, raw UTF-8
+    encoded = json.dumps(
+        spec, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    ).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _ensure_private_dir(path: str) -> bool:
+    """Create a directory with mode 0700 if missing; True only if this user alone can reach it.
+
+    Shared locations such as /tmp and /dev/shm let any local user create the path first
+    and plant files in it, so ownership and mode are checked on every call.
+    """
+    try:
+        try:
+            st = os.lstat(path)
+        except FileNotFoundError:
+            try:
+                os.mkdir(path, 0o700)
+            except FileExistsError:
+                pass  # Created concurrently; checked below like any other
+            st = os.lstat(path)
+    except OSError:
+        return False
+    if not stat.S_ISDIR(st.st_mode):
+        return False
+    if hasattr(os, "getuid") and (st.st_uid != os.getuid() or st.st_mode & 0o077):
+        return False
+    return True
+
+
+def _require_cache_dir() -> None:
+    """Raise PermissionError unless OUTPUT_DIR is a private directory of this user."""
+    if not _ensure_private_dir(OUTPUT_DIR_STR):
+        raise PermissionError(f"{OUTPUT_DIR_STR} is not a directory private to this user")
+
+
+def _cache_base(spec_hash: str) -> str:
+    """Return the cache entry path for a spec hash, without extension."""
+    return os.path.join(OUTPUT_DIR_STR, spec_hash)
+
+
+class CacheMemo:
+    """Thread-safe LRU of (text, payload) entries, bounded by their total length.
+
+    Entries longer than max_entry_chars are never held, so one huge render cannot push
+    out everything else.
+    """
+
+    def __init__(self, max_chars: int, max_entry_chars: int):
+        self.max_chars = max_chars
+        self.max_entry_chars = max_entry_chars
+        self._entries: OrderedDict[str, tuple[str, str]] = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> tuple[str, str] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: str, entry: tuple[str, str]) -> None:
+        size = len(entry[0]) + len(entry[1])
+        if size > self.max_entry_chars:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._chars -= len(old[0]) + len(old[1])
+            self._entries[key] = entry
+            self._chars += size
+            while self._chars > self.max_chars:
+                _, (text, payload) = self._entries.popitem(last=False)
+                self._chars -= len(text) + len(payload)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._chars = 0
+
+
+_cache_memo = CacheMemo(CACHE_MEMO_MAX_CHARS, CACHE_MEMO_MAX_ENTRY_CHARS)
+
+
+def _load_cached_diagram(spec_hash: str) -> tuple[str, str]:
+    """Load a previously rendered diagram's summary text and payload.
+
+    Recently loaded entries come from _cache_memo, others from OUTPUT_DIR. Raises OSError
+    on a miss.
+    """
+    cached = _cache_memo.get(spec_hash)
+    if cached is not None:
+        return cached
+    _require_cache_dir()
+    base = _cache_base(spec_hash)
+    with open(base + ".txt", encoding="utf-8") as f:
+        text = f.read()
+    with open(base + ".payload", encoding="utf-8") as f:
+        payload = f.read()
+    _cache_memo.put(spec_hash, (text, payload))
+    return text, payload
+
+
+def _write_atomic(path: str, text: str) -> None:
+    """Write a file under a temporary name, then rename it into place.
+
+    Readers see either no file or the complete one, never a partial write.
+    """
+    # mkstemp picks an unguessable name and refuses to follow a planted symlink
+    fd, partial = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with open(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(partial, path)
+    except BaseException:
+        try:
+            os.remove(partial)
+        except OSError:
+            pass
+        raise
+
+
+def _store_cached_diagram(spec_hash: str, text: str, payload: str) -> None:
+    """Persist a rendered diagram so identical requests skip Graphviz."""
+    _require_cache_dir()
+    base = _cache_base(spec_hash)
+    _write_atomic(base + ".txt", text)
+    # Renamed into place last: its presence marks the entry as complete.
+    _write_atomic(base + ".payload", payload)
+    _prune_cache()
+
+
+def _prune_cache() -> None:
+    """Delete the least recently written entries beyond CACHE_MAX_ENTRIES."""
+    with os.scandir(OUTPUT_DIR_STR) as it:
+        entries = [e for e in it if e.name.endswith(".payload")]
+    if len(entries) <= CACHE_MAX_ENTRIES:
+        return
+    entries.sort(key=lambda e: e.stat().st_mtime)
+    for entry in entries[:-CACHE_MAX_ENTRIES]:
+        base = entry.path.removesuffix(".payload")
+        for path in (entry.path, base + ".txt"):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def _diagram_response(
+    fmt: str, spec_hash: str, text: str, payload: str
+) -> list[TextContent | ImageContent | EmbeddedResource]:
+    """Build the MCP response for a rendered diagram.
+
+    payload is the SVG markup for 'svg', the base64 PNG for 'png', the DOT source for
+    'dot', and unused for 'text'.
+    """
+    response = [
+        TextContent(
+            type="text",
+            text=text
+        )
+    ]
+    if fmt == "svg":
+        response.append(
+            EmbeddedResource(
+                type="resource",
+                resource=TextResourceContents(
+                    uri=f"diagram://{spec_hash}.svg",
+                    mimeType="image/svg+xml",
+                    text=payload
+                )
+            )
+        )
+    elif fmt == "png":
+        response.append(
+            ImageContent(
+                type="image",
+                data=payload,
+                mimeType="image/png"
+            )
+        )
+    elif fmt == "dot":
+        response.append(
+            TextContent(
+                type="text",
+                text=payload
+            )
+        )
+    return response
+
+
+# Output formats accepted by the build-* tools
+OutputFormat = Literal["svg", "png", "dot", "text"]
+OUTPUT_FORMATS = get_args(OutputFormat)
+
+FORMAT_SCHEMA = {
+    "type": "string",
+    "enum": list(OUTPUT_FORMATS),
+    "default": "svg",
+    "description": "Output format: 'svg' image (default), 'png' image, 'dot' source returned as text, or 'text' for the summary only (no rendering)"
+}
+
+
 @server.list_tools()
 async def list_tools() -> list[Tool]:
     """List available architecture diagram tools."""
-    return [
+    tools = [
         Tool(
             name="build-kubernetes-diagram",
             description="Generate a Kubernetes architecture diagram with deployments, services, ingress, storage, and other K8s resources. Supports namespace clustering and component connections.",
@@ -81,7 +495,7 @@ async def list_tools() -> list[Tool]:
                             "properties": {
                                 "type": {"type": "string"},
                                 "name": {"type": "string"},
-                                "replicas": {"type": "number"}
+                                "replicas": {"type": "integer"}
                             },
                             "required": ["type", "name"]
                         }
@@ -112,7 +526,8 @@ async def list_tools() -> list[Tool]:
                             },
                             "required": ["from", "to"]
                         }
-                    }
+                    },
+                    "format": FORMAT_SCHEMA
                 },
                 "required": ["name", "components"]
             }
@@ -165,7 +580,8 @@ async def list_tools() -> list[Tool]:
                             },
                             "required": ["from", "to"]
                         }
-                    }
+                    },
+                    "format": FORMAT_SCHEMA
                 },
                 "required": ["name", "components"]
             }
@@ -218,17 +634,56 @@ async def list_tools() -> list[Tool]:
                             },
                             "required": ["from", "to"]
                         }
-                    }
+                    },
+                    "format": FORMAT_SCHEMA
                 },
                 "required": ["name", "components"]
             }
         )
     ]
+    tools.append(
+        Tool(
+            name=BATCH_TOOL_NAME,
+            description="Generate several Kubernetes, AWS, and/or GCP architecture diagrams in one call. Diagrams are rendered concurrently; an invalid entry is reported by its index.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "diagrams": {
+                        "type": "array",
+                        "description": "Diagrams to build, each naming the single-diagram tool and its arguments",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "tool": {
+                                    "type": "string",
+                                    "enum": [tool.name for tool in tools]
+                                },
+                                "arguments": {
+                                    "anyOf": [tool.inputSchema for tool in tools]
+                                }
+                            },
+                            "required": ["tool", "arguments"]
+                        }
+                    }
+                },
+                "required": ["diagrams"]
+            }
+        )
+    )
+    return tools
 
 
-def get_k8s_component(comp_type: str, name: str):
-    """Map component type to diagrams K8s class."""
-    mapping = {
+# diagrams classes by lowercase component type, per provider. Each provider's modules
+# are only imported the first time that provider is used.
+@functools.cache
+def k8s_classes() -> dict[str, type[Node]]:
+    """Map component types to diagrams K8s classes."""
+    from diagrams.k8s.clusterconfig import HPA
+    from diagrams.k8s.compute import DaemonSet, Deployment, Job, Pod, ReplicaSet, StatefulSet
+    from diagrams.k8s.network import Ingress, Service
+    from diagrams.k8s.podconfig import ConfigMap, Secret
+    from diagrams.k8s.storage import PV, PVC, StorageClass
+    return {
         "deployment": Deployment,
         "statefulset": StatefulSet,
         "daemonset": DaemonSet,
@@ -244,15 +699,17 @@ def get_k8s_component(comp_type: str, name: str):
         "hpa": HPA,
         "replicaset": ReplicaSet
     }
-    component_class = mapping.get(comp_type.lower())
-    if component_class:
-        return component_class(name)
-    return None
 
 
-def get_aws_component(comp_type: str, name: str):
-    """Map component type to diagrams AWS class."""
-    mapping = {
+@functools.cache
+def aws_classes() -> dict[str, type[Node]]:
+    """Map component types to diagrams AWS classes."""
+    from diagrams.aws.compute import EC2, ECS, EKS, Lambda
+    from diagrams.aws.database import RDS, Dynamodb, Elasticache, Redshift
+    from diagrams.aws.integration import SNS, SQS, Eventbridge
+    from diagrams.aws.network import ALB, ELB, NLB, VPC, CloudFront, Route53
+    from diagrams.aws.storage import EBS, EFS, S3
+    return {
         "ec2": EC2,
         "ecs": ECS,
         "eks": EKS,
@@ -274,15 +731,18 @@ def get_aws_component(comp_type: str, name: str):
         "sns": SNS,
         "eventbridge": Eventbridge
     }
-    component_class = mapping.get(comp_type.lower())
-    if component_class:
-        return component_class(name)
-    return None
 
 
-def get_gcp_component(comp_type: str, name: str):
-    """Map component type to diagrams GCP class."""
-    mapping = {
+@functools.cache
+def gcp_classes() -> dict[str, type[Node]]:
+    """Map component types to diagrams GCP classes."""
+    from diagrams.gcp.analytics import BigQuery, Dataflow, Pubsub
+    from diagrams.gcp.compute import GCE, GKE, ComputeEngine, Functions
+    from diagrams.gcp.database import SQL, BigTable, Firestore, Spanner
+    from diagrams.gcp.network import DNS, LoadBalancing
+    from diagrams.gcp.network import VPC as GCP_VPC
+    from diagrams.gcp.storage import GCS, PersistentDisk
+    return {
         "gce": GCE,
         "gke": GKE,
         "computeengine": ComputeEngine,
@@ -300,209 +760,477 @@ def get_gcp_component(comp_type: str, name: str):
         "dataflow": Dataflow,
         "pubsub": Pubsub
     }
-    component_class = mapping.get(comp_type.lower())
-    if component_class:
-        return component_class(name)
-    return None
 
 
-@server.call_tool()
-async def call_tool(name: str, arguments: Any) -> list[TextContent | ImageContent | EmbeddedResource]:
-    """Handle tool calls for building architecture diagrams."""
+class Component(BaseModel):
+    """A single diagram node."""
 
-    if name == "build-kubernetes-diagram":
-        diagram_name = arguments.get("name", "k8s-architecture")
-        components_config = arguments.get("components", [])
-        clusters_config = arguments.get("clusters", [])
-        connections_config = arguments.get("connections", [])
-
-        output_file = OUTPUT_DIR / f"{diagram_name}"
-
-        with Diagram(diagram_name, filename=str(output_file), show=False, direction="LR"):
-            # Create component objects
-            components = {}
-
-            # Handle clusters
-            if clusters_config:
-                for cluster_config in clusters_config:
-                    cluster_name = cluster_config.get("name", "Cluster")
-                    cluster_component_names = cluster_config.get("components", [])
-
-                    with Cluster(cluster_name):
-                        for comp_config in components_config:
-                            if comp_config["name"] in cluster_component_names:
-                                comp = get_k8s_component(comp_config["type"], comp_config["name"])
-                                if comp:
-                                    components[comp_config["name"]] = comp
-
-            # Create remaining components not in clusters
-            for comp_config in components_config:
-                if comp_config["name"] not in components:
-                    comp = get_k8s_component(comp_config["type"], comp_config["name"])
-                    if comp:
-                        components[comp_config["name"]] = comp
-
-            # Create connections
-            for conn in connections_config:
-                from_comp = components.get(conn["from"])
-                to_comp = components.get(conn["to"])
-                label = conn.get("label", "")
-
-                if from_comp and to_comp:
-                    if label:
-                        from_comp >> Edge(label=label) >> to_comp
-                    else:
-                        from_comp >> to_comp
-
-        # Read the generated image
-        image_path = f"{output_file}.png"
-        with open(image_path, "rb") as f:
-            image_data = base64.b64encode(f.read()).decode("utf-8")
-
-        return [
-            TextContent(
-                type="text",
-                text=f"Kubernetes architecture diagram '{diagram_name}' created successfully with {len(components)} components."
-            ),
-            ImageContent(
-                type="image",
-                data=image_data,
-                mimeType="image/png"
-            )
-        ]
-
-    elif name == "build-aws-diagram":
-        diagram_name = arguments.get("name", "aws-architecture")
-        components_config = arguments.get("components", [])
-        vpcs_config = arguments.get("vpcs", [])
-        connections_config = arguments.get("connections", [])
-
-        output_file = OUTPUT_DIR / f"{diagram_name}"
-
-        with Diagram(diagram_name, filename=str(output_file), show=False, direction="LR"):
-            components = {}
-
-            # Handle VPCs
-            if vpcs_config:
-                for vpc_config in vpcs_config:
-                    vpc_name = vpc_config.get("name", "VPC")
-                    vpc_component_names = vpc_config.get("components", [])
-
-                    with Cluster(vpc_name):
-                        for comp_config in components_config:
-                            if comp_config["name"] in vpc_component_names:
-                                comp = get_aws_component(comp_config["type"], comp_config["name"])
-                                if comp:
-                                    components[comp_config["name"]] = comp
-
-            # Create remaining components not in VPCs
-            for comp_config in components_config:
-                if comp_config["name"] not in components:
-                    comp = get_aws_component(comp_config["type"], comp_config["name"])
-                    if comp:
-                        components[comp_config["name"]] = comp
-
-            # Create connections
-            for conn in connections_config:
-                from_comp = components.get(conn["from"])
-                to_comp = components.get(conn["to"])
-                label = conn.get("label", "")
-
-                if from_comp and to_comp:
-                    if label:
-                        from_comp >> Edge(label=label) >> to_comp
-                    else:
-                        from_comp >> to_comp
-
-        # Read the generated image
-        image_path = f"{output_file}.png"
-        with open(image_path, "rb") as f:
-            image_data = base64.b64encode(f.read()).decode("utf-8")
-
-        return [
-            TextContent(
-                type="text",
-                text=f"AWS architecture diagram '{diagram_name}' created successfully with {len(components)} components."
-            ),
-            ImageContent(
-                type="image",
-                data=image_data,
-                mimeType="image/png"
-            )
-        ]
-
-    elif name == "build-gcp-diagram":
-        diagram_name = arguments.get("name", "gcp-architecture")
-        components_config = arguments.get("components", [])
-        vpcs_config = arguments.get("vpcs", [])
-        connections_config = arguments.get("connections", [])
-
-        output_file = OUTPUT_DIR / f"{diagram_name}"
-
-        with Diagram(diagram_name, filename=str(output_file), show=False, direction="LR"):
-            components = {}
-
-            # Handle VPCs/Networks
-            if vpcs_config:
-                for vpc_config in vpcs_config:
-                    vpc_name = vpc_config.get("name", "VPC")
-                    vpc_component_names = vpc_config.get("components", [])
-
-                    with Cluster(vpc_name):
-                        for comp_config in components_config:
-                            if comp_config["name"] in vpc_component_names:
-                                comp = get_gcp_component(comp_config["type"], comp_config["name"])
-                                if comp:
-                                    components[comp_config["name"]] = comp
-
-            # Create remaining components not in VPCs
-            for comp_config in components_config:
-                if comp_config["name"] not in components:
-                    comp = get_gcp_component(comp_config["type"], comp_config["name"])
-                    if comp:
-                        components[comp_config["name"]] = comp
-
-            # Create connections
-            for conn in connections_config:
-                from_comp = components.get(conn["from"])
-                to_comp = components.get(conn["to"])
-                label = conn.get("label", "")
-
-                if from_comp and to_comp:
-                    if label:
-                        from_comp >> Edge(label=label) >> to_comp
-                    else:
-                        from_comp >> to_comp
-
-        # Read the generated image
-        image_path = f"{output_file}.png"
-        with open(image_path, "rb") as f:
-            image_data = base64.b64encode(f.read()).decode("utf-8")
-
-        return [
-            TextContent(
-                type="text",
-                text=f"GCP architecture diagram '{diagram_name}' created successfully with {len(components)} components."
-            ),
-            ImageContent(
-                type="image",
-                data=image_data,
-                mimeType="image/png"
+    type: str
+    name: str
+    replicas: int = 1
+
+
+class ComponentGroup(BaseModel):
+    """A named cluster/VPC grouping of component names."""
+
+    name: str | None = None
+    components: list[str] = []
+
+
+class Connection(BaseModel):
+    """A directed edge between two components."""
+
+    from_: str = Field(alias="from")
+    to: str
+    label: str = ""
+
+
+class DiagramRequest(BaseModel):
+    """Arguments shared by all build-* tools."""
+
+    name: str
+    components: list[Component] = []
+    connections: list[Connection] = []
+    format: OutputFormat = "svg"
+
+    @model_validator(mode="after")
+    def _check_connections(self):
+        """Reject connections to undefined components before paying for a render."""
+        known = {c.name for c in self.components}
+        unknown = sorted(
+            {n for conn in self.connections for n in (conn.from_, conn.to)} - known
+        )
+        if unknown:
+            raise ValueError(f"Connections reference unknown components: {', '.join(unknown)}")
+        return self
+
+
+class K8sDiagramRequest(DiagramRequest):
+    name: str = "k8s-architecture"
+    clusters: list[ComponentGroup] = []
+
+
+class AwsDiagramRequest(DiagramRequest):
+    name: str = "aws-architecture"
+    vpcs: list[ComponentGroup] = []
+
+
+class GcpDiagramRequest(DiagramRequest):
+    name: str = "gcp-architecture"
+    vpcs: list[ComponentGroup] = []
+
+
+class BatchItem(BaseModel):
+    """One diagram in a build-architecture-batch call."""
+
+    tool: str
+    arguments: dict[str, Any]
+
+
+class BatchRequest(BaseModel):
+    """Arguments for the build-architecture-batch tool."""
+
+    diagrams: list[BatchItem]
+
+
+class DiagramProvider(NamedTuple):
+    """How one build-* tool maps its arguments onto diagrams classes."""
+
+    label: str
+    classes: Callable[[], dict[str, type[Node]]]
+    request_model: type[DiagramRequest]
+    group_key: str
+    default_group: str
+
+
+# Tool name -> provider settings
+DIAGRAM_PROVIDERS = {
+    "build-kubernetes-diagram": DiagramProvider(
+        "Kubernetes", k8s_classes, K8sDiagramRequest, "clusters", "Cluster"
+    ),
+    "build-aws-diagram": DiagramProvider(
+        "AWS", aws_classes, AwsDiagramRequest, "vpcs", "VPC"
+    ),
+    "build-gcp-diagram": DiagramProvider(
+        "GCP", gcp_classes, GcpDiagramRequest, "vpcs", "VPC"
+    ),
+}
+
+
+# Cluster background for top-level groups; diagrams alternates colours by nesting depth
+CLUSTER_BGCOLOR = "#E5F5FD"
+
+
+def _quote(value: str) -> str:
+    """Quote text as a DOT string that always parses.
+
+    It is never read as an HTML-like label, and an odd run of trailing backslashes (which
+    would escape the closing quote) gets one more so it stays literal text.
+    """
+    if (len(value) - len(value.rstrip("\\"))) % 2:
+        value += "\\"
+    return quote(nohtml(value))
+
+
+def _dot_attrs(attrs: dict, label: str | None = None) -> str:
+    """Format a DOT attribute list the way the graphviz package does.
+
+    Attributes are sorted; a node/edge label, when given, comes first.
+    """
+    items = [("label", label)] if label is not None else []
+    items += sorted(attrs.items())
+    return "[" + " ".join(f"{key}={_quote(str(value))}" for key, value in items) + "]"
+
+
+# Icons ship in site-packages/resources/<provider>/<category>/, next to the diagrams package
+RESOURCES_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(diagrams.__file__)))
+
+# Used icons are copied under tmpfs (Linux only) into a private per-user directory,
+# versioned so upgrades never see stale files
+ICON_CACHE_DIR = (
+    f"/dev/shm/diagrams_icons-{os.getuid()}-{importlib.metadata.version('diagrams')}"
+    if hasattr(os, "getuid") else None
+)
+
+
+def _private_icon_dir() -> str | None:
+    """Return ICON_CACHE_DIR, creating it, if it is a directory only this user can reach.
+
+    Checked on every use: tmpfs may be cleaned, or the path taken over by another user.
+    """
+    if ICON_CACHE_DIR is None or not _ensure_private_dir(ICON_CACHE_DIR):
+        return None
+    return ICON_CACHE_DIR
+
+
+@functools.cache
+def _packaged_icon_path(node_class: type[Node]) -> str:
+    """Resolve a diagrams node class to its icon PNG, as Node._load_icon does."""
+    return os.path.join(RESOURCES_ROOT, node_class._icon_dir, node_class._icon)
+
+
+def _stage_icon(icon_dir: str, node_class: type[Node]) -> str:
+    """Copy a node class's icon PNG into icon_dir unless present; return the path to use.
+
+    Any failure falls back to the packaged file.
+    """
+    source = _packaged_icon_path(node_class)
+    staged = os.path.join(
+        icon_dir, os.path.relpath(node_class._icon_dir, "resources"), node_class._icon
+    )
+    if not os.path.exists(staged):
+        # Copy then rename, so concurrent renders never see a partial file
+        partial = f"{staged}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(staged), exist_ok=True)
+            shutil.copyfile(source, partial)
+            os.replace(partial, staged)
+        except OSError:
+            try:
+                os.remove(partial)
+            except OSError:
+                pass
+            return source
+    return staged
+
+
+def _icon_resolver(stage: bool) -> Callable[[type[Node]], str]:
+    """Return the icon lookup for one _emit_dot call, staging on tmpfs when asked and able.
+
+    Icons are copied on first use rather than up front so unused providers (and their
+    ~700 icon files) are never touched. The staging directory is checked once per call,
+    not per node, and each node class is resolved at most once per call.
+    """
+    icon_dir = _private_icon_dir() if stage else None
+    if icon_dir is None:
+        return _packaged_icon_path
+
+    resolved = {}
+
+    def icon_path(node_class: type[Node]) -> str:
+        path = resolved.get(node_class)
+        if path is None:
+            path = resolved[node_class] = _stage_icon(icon_dir, node_class)
+        return path
+
+    return icon_path
+
+
+# Graphviz SVG draws each node icon as <image xlink:href="<file path>" .../>
+SVG_IMAGE = re.compile(r"<image\b([^>]*?)/>")
+SVG_ATTR = re.compile(r'([\w:-]+)="([^"]*)"')
+SVG_ROOT = re.compile(r"<svg\b[^>]*>")
+
+
+@functools.cache
+def _icon_symbol(path: str) -> tuple[str, int, int]:
+    """Return an icon PNG as (data: URI, pixel width, pixel height).
+
+    Raises OSError if it cannot be read.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    width, height = struct.unpack(">II", data[16:24])  # From the IHDR chunk
+    return "data:image/png;base64," + b64encode(data).decode("ascii"), width, height
+
+
+def _inline_icons(svg: str) -> str:
+    """Embed the icons referenced by Graphviz SVG, each distinct icon only once.
+
+    Clients cannot resolve paths on the server, so without this every icon is missing
+    (and the server's filesystem layout is exposed). Each icon becomes one <symbol> in
+    <defs>, and every node that shows it a small <use> of that symbol.
+    """
+    symbols = {}
+
+    def use(match: re.Match) -> str:
+        attrs = dict(SVG_ATTR.findall(match[1]))
+        href = attrs.pop("xlink:href", None)
+        if href is None:
+            return match[0]
+        aspect = attrs.pop("preserveAspectRatio", "xMidYMid meet")
+        key = (html.unescape(href), aspect)
+        symbol_id = symbols.get(key)
+        if symbol_id is None:
+            try:
+                _icon_symbol(key[0])
+            except OSError:
+                return ""
+            symbol_id = symbols[key] = f"icon-{len(symbols)}"
+        rest = " ".join(f'{name}="{value}"' for name, value in attrs.items())
+        return f'<use xlink:href="#{symbol_id}" {rest}/>'
+
+    svg = SVG_IMAGE.sub(use, svg)
+    root = SVG_ROOT.search(svg)
+    if not symbols or root is None:
+        return svg
+
+    defs = ["<defs>"]
+    for (path, aspect), symbol_id in symbols.items():
+        uri, width, height = _icon_symbol(path)
+        defs.append(
+            f'<symbol id="{symbol_id}" viewBox="0 0 {width} {height}" '
+            f'preserveAspectRatio="{aspect}">'
+            f'<image xlink:href="{uri}" width="{width}" height="{height}"/></symbol>'
+        )
+    defs.append("</defs>")
+    return svg[:root.end()] + "\n" + "\n".join(defs) + svg[root.end():]
+
+
+def _emit_dot(request: DiagramRequest, provider: DiagramProvider) -> tuple[str, int]:
+    """Build DOT source for a request directly, returning (source, component count).
+
+    Produces the same graph the diagrams library would (its default styles, icons and
+    cluster look) without allocating Diagram/Node/Edge objects per request.
+    """
+    classes = provider.classes()
+    diagram_name = request.name
+    # Only dot itself reads the tmpfs copies; returned DOT names the packaged icons
+    icon_path = _icon_resolver(stage=request.format in ("svg", "png"))
+
+    graph_attrs = {
+        **Diagram._default_graph_attrs, "label": diagram_name, "rankdir": "LR", "splines": "ortho"
+    }
+    lines = [
+        f"digraph {_quote(diagram_name)} {{",
+        f"\tgraph {_dot_attrs(graph_attrs)}",
+        f"\tnode {_dot_attrs(Diagram._default_node_attrs)}",
+        f"\tedge {_dot_attrs(Diagram._default_edge_attrs)}",
+    ]
+
+    node_ids = {}
+
+    def emit_node(comp_name: str, comp_type: str, indent: str) -> None:
+        node_class = classes.get(comp_type.lower())
+        if node_class is None:
+            return
+        node_id = node_ids[comp_name] = f"n{len(node_ids)}"
+        attrs = {}
+        if node_class._icon:
+            # Same sizing rule as diagrams.Node: taller for multi-line labels
+            attrs.update(
+                shape="none",
+                height=str(node_class._height + 0.4 * comp_name.count("\n")),
+                image=icon_path(node_class),
             )
-        ]
+        lines.append(f"{indent}{node_id} {_dot_attrs(attrs, label=comp_name)}")
+
+    # Index by name once so grouping is a dict lookup, not a rescan per group
+    by_name = {c.name: c for c in request.components}
+    assigned = set()
+
+    # Handle clusters/VPCs
+    for index, group in enumerate(getattr(request, provider.group_key)):
+        group_name = group.name if group.name is not None else provider.default_group
+        cluster_attrs = {
+            **Cluster._default_graph_attrs,
+            "label": group_name,
+            "rankdir": "LR",
+            "bgcolor": CLUSTER_BGCOLOR,
+        }
+        lines.append(f"\tsubgraph cluster_{index} {{")
+        lines.append(f"\t\tgraph {_dot_attrs(cluster_attrs)}")
+        for comp_name in group.components:
+            comp_config = by_name.get(comp_name)
+            if comp_config and comp_name not in assigned:
+                emit_node(comp_name, comp_config.type, "\t\t")
+                assigned.add(comp_name)
+        lines.append("\t}")
 
+    # Create remaining components not in a group
+    for comp_name, comp_config in by_name.items():
+        if comp_name not in assigned:
+            emit_node(comp_name, comp_config.type, "\t")
+
+    # Create connections; the attribute list is formatted once per distinct label
+    edge_attrs = {}
+    for conn in request.connections:
+        from_id = node_ids.get(conn.from_)
+        to_id = node_ids.get(conn.to)
+
+        if from_id and to_id:
+            attrs = edge_attrs.get(conn.label)
+            if attrs is None:
+                attrs = edge_attrs[conn.label] = _dot_attrs(
+                    {**Edge._default_edge_attrs, "dir": "forward"}, label=conn.label or None
+                )
+            lines.append(f"\t{from_id} -> {to_id} {attrs}")
+
+    lines.append("}")
+    return "\n".join(lines) + "\n", len(node_ids)
+
+
+def _render(request: DiagramRequest, provider: DiagramProvider) -> tuple[str, str]:
+    """Build and render a diagram for one provider, returning (summary text, payload)."""
+    source, component_count = _emit_dot(request, provider)
+
+    # Only run Graphviz for the formats that need it
+    fmt = request.format
+    if fmt == "text":
+        payload = ""
+    elif fmt == "dot":
+        payload = source
+    elif fmt == "svg":
+        payload = _inline_icons(render_image(source, "svg").decode("utf-8"))
     else:
+        # base64 output is pure ASCII, so skip UTF-8 validation
+        payload = b64encode(render_image(source, "png")).decode("ascii")
+
+    text = f"{provider.label} architecture diagram '{request.name}' created successfully with {component_count} components."
+    return text, payload
+
+
+def _validate_request(name: str, arguments: Any) -> tuple[DiagramProvider, DiagramRequest]:
+    """Look up a build-* tool and validate its arguments once; unknown keys are ignored.
+
+    Raises ValueError (including pydantic's ValidationError) on bad input.
+    """
+    provider = DIAGRAM_PROVIDERS.get(name)
+    if provider is None:
         raise ValueError(f"Unknown tool: {name}")
+    return provider, provider.request_model.model_validate(arguments)
+
+
+async def _build_diagram(
+    name: str, arguments: Any, run: Callable
+) -> list[TextContent | ImageContent | EmbeddedResource]:
+    """Validate, cache-check and render one diagram; run(func, *args) executes the render."""
+    provider, request = _validate_request(name, arguments)
+    return await _build_request(name, provider, request, run)
+
+
+async def _build_request(
+    name: str, provider: DiagramProvider, request: DiagramRequest, run: Callable
+) -> list[TextContent | ImageContent | EmbeddedResource]:
+    """Cache-check and render one validated diagram request."""
+    if not request.components:
+        return [TextContent(type="text", text=f"{request.name}: no components specified")]
+
+    # Text needs no Graphviz, so re-emitting it is cheaper than a cache round trip
+    if request.format == "text":
+        text, _ = await run(_render, request, provider)
+        return [TextContent(type="text", text=text)]
+
+    # Identical specs render identical diagrams; serve them without re-running Graphviz.
+    # The cache is best effort: an unreadable or unwritable OUTPUT_DIR just means a render.
+    spec_hash = _spec_hash(name, request.model_dump(by_alias=True))
+    try:
+        cached = await asyncio.to_thread(_load_cached_diagram, spec_hash)
+        return _diagram_response(request.format, spec_hash, *cached)
+    except (OSError, ValueError):
+        pass
+
+    text, payload = await run(_render, request, provider)
+    try:
+        await asyncio.to_thread(_store_cached_diagram, spec_hash, text, payload)
+    except OSError:
+        pass
+    return _diagram_response(request.format, spec_hash, text, payload)
+
+
+@server.call_tool()
+async def call_tool(name: str, arguments: Any) -> list[TextContent | ImageContent | EmbeddedResource]:
+    """Handle tool calls for building architecture diagrams."""
+    if name == BATCH_TOOL_NAME:
+        return await _build_batch(arguments)
+
+    # Rendering blocks on Graphviz; keep it off the event loop so other requests proceed
+    return await _build_diagram(name, arguments, asyncio.to_thread)
+
+
+async def _build_batch(arguments: Any) -> list[TextContent | ImageContent | EmbeddedResource]:
+    """Handle build-architecture-batch: validate every entry, then render them concurrently.
+
+    Renders share the renderer threads and dot workers with single-diagram calls; the work
+    is in the dot processes, so more Python processes would only add startup cost.
+    """
+    batch = BatchRequest.model_validate(arguments)
+
+    # Reject the whole batch before rendering anything, naming every bad entry
+    requests, errors = [], []
+    for index, item in enumerate(batch.diagrams):
+        try:
+            requests.append((item.tool, *_validate_request(item.tool, item.arguments)))
+        except ValueError as e:
+            errors.append(f"diagrams[{index}] ({item.tool}): {e}")
+    if errors:
+        raise ValueError("Invalid batch entries:\n" + "\n".join(errors))
+
+    # One failed render must not throw away the others
+    results = await asyncio.gather(
+        *(_build_request(*request, asyncio.to_thread) for request in requests),
+        return_exceptions=True,
+    )
+    contents = []
+    for index, ((tool, _, _), result) in enumerate(zip(requests, results)):
+        if isinstance(result, Exception):
+            message = f"diagrams[{index}] ({tool}): render failed: {result}"
+            contents.append(TextContent(type="text", text=message))
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            contents.extend(result)
+    return contents
 
 
 async def async_main():
     """Run the MCP server."""
-    async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
-        await server.run(
-            read_stream,
-            write_stream,
-            server.create_initialization_options()
-        )
+    # Renders run in threads, each able to claim its own dot worker, so they run in parallel
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=RENDER_CONCURRENCY)
+    )
+    for pool in dot_pools.values():
+        await pool.start()
+    try:
+        async with mcp.server.stdio.stdio_server() as (read_stream, write_stream):
+            await server.run(
+                read_stream,
+                write_stream,
+                server.create_initialization_options()
+            )
+    finally:
+        for pool in dot_pools.values():
+            await pool.close()
 
 
 def main():
@@ -0,0 +1,618 @@
+"""Tests for the Cloud Native Architecture MCP server."""
+
+import asyncio
+import json
+import os
+import re
+import shutil
+import struct
+import sys
+import threading
+import xml.etree.ElementTree as ET
+import zlib
+from pathlib import Path
+
+import diagrams
+import pytest
+from diagrams import Cluster, Diagram, Edge
+from mcp.types import TextContent
+from pydantic import ValidationError
+
+from cloud_native_architecture_mcp import server
+
+EXAMPLES_DIR = Path(__file__).resolve().parent.parent / "examples"
+
+EXAMPLES = [
+    ("build-kubernetes-diagram", "kubernetes_example.json"),
+    ("build-aws-diagram", "aws_example.json"),
+    ("build-gcp-diagram", "gcp_example.json"),
+]
+
+
+def load_example(filename: str) -> dict:
+    with open(EXAMPLES_DIR / filename, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def png_bytes() -> bytes:
+    """A minimal valid 1x1 PNG."""
+    def chunk(chunk_type: bytes, data: bytes) -> bytes:
+        crc = zlib.crc32(chunk_type + data) & 0xFFFFFFFF
+        return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", crc)
+
+    return (
+        server.PNG_SIGNATURE
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 0, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(b"\x00\x00"))
+        + chunk(b"IEND", b"")
+    )
+
+
+def stream_of(data: bytes) -> asyncio.StreamReader:
+    """A StreamReader holding data, then EOF. Must be called inside a running loop."""
+    reader = asyncio.StreamReader()
+    reader.feed_data(data)
+    reader.feed_eof()
+    return reader
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Point the render cache at a fresh directory for every test."""
+    output_dir = tmp_path / "architecture_diagrams"
+    monkeypatch.setattr(server, "OUTPUT_DIR", output_dir)
+    monkeypatch.setattr(server, "OUTPUT_DIR_STR", str(output_dir))
+    server._cache_memo.clear()
+    yield output_dir
+    server._cache_memo.clear()
+
+
+def diagrams_dot(arguments: dict, provider: server.DiagramProvider) -> str:
+    """Build DOT with the diagrams library, the way the server originally did."""
+    classes = provider.classes()
+    sources = []
+
+    def capture(self, *exc_info):
+        sources.append(self.dot.source)
+        diagrams.setdiagram(None)
+
+    original_exit = Diagram.__exit__
+    Diagram.__exit__ = capture
+    try:
+        components_config = arguments.get("components", [])
+        with Diagram(arguments["name"], show=False, direction="LR"):
+            components = {}
+            for group in arguments.get(provider.group_key, []):
+                with Cluster(group.get("name", provider.default_group)):
+                    for comp_config in components_config:
+                        if comp_config["name"] in group.get("components", []):
+                            node_class = classes.get(comp_config["type"].lower())
+                            if node_class:
+                                components[comp_config["name"]] = node_class(comp_config["name"])
+            for comp_config in components_config:
+                if comp_config["name"] not in components:
+                    node_class = classes.get(comp_config["type"].lower())
+                    if node_class:
+                        components[comp_config["name"]] = node_class(comp_config["name"])
+            for conn in arguments.get("connections", []):
+                from_comp = components.get(conn["from"])
+                to_comp = components.get(conn["to"])
+                if from_comp and to_comp:
+                    if conn.get("label"):
+                        from_comp >> Edge(label=conn["label"]) >> to_comp
+                    else:
+                        from_comp >> to_comp
+    finally:
+        Diagram.__exit__ = original_exit
+    return sources[0]
+
+
+def normalize_ids(source: str) -> str:
+    """Replace node and cluster identifiers with sequential placeholders."""
+    ids = {}
+    pattern = r'"?\b[0-9a-f]{32}\b"?|\bn\d+\b|"cluster_[^"]+"|cluster_\w+'
+    return re.sub(pattern, lambda m: ids.setdefault(m[0], f"ID{len(ids)}"), source)
+
+
+@pytest.mark.parametrize("tool_name, filename", EXAMPLES)
+def test_emit_dot_matches_diagrams(tool_name, filename):
+    arguments = dict(load_example(filename), format="dot")
+    provider = server.DIAGRAM_PROVIDERS[tool_name]
+    request = provider.request_model.model_validate(arguments)
+
+    source, count = server._emit_dot(request, provider)
+
+    assert normalize_ids(source) == normalize_ids(diagrams_dot(arguments, provider))
+    assert count == len(arguments["components"])
+
+
+def test_dot_format_references_packaged_icons():
+    provider = server.DIAGRAM_PROVIDERS["build-aws-diagram"]
+    request = provider.request_model.model_validate(
+        {"name": "icons", "components": [{"type": "ec2", "name": "web"}], "format": "dot"}
+    )
+    source, _ = server._emit_dot(request, provider)
+    assert f'image="{server.RESOURCES_ROOT}' in source
+
+
+def test_icon_staging_resolved_once_per_emit(monkeypatch, tmp_path):
+    stage_dir = tmp_path / "icons"
+    monkeypatch.setattr(server, "ICON_CACHE_DIR", str(stage_dir))
+    checks, staged = [], []
+    ensure, stage = server._ensure_private_dir, server._stage_icon
+    monkeypatch.setattr(
+        server, "_ensure_private_dir", lambda path: checks.append(path) or ensure(path)
+    )
+    monkeypatch.setattr(
+        server, "_stage_icon", lambda icon_dir, cls: staged.append(cls) or stage(icon_dir, cls)
+    )
+    provider = server.DIAGRAM_PROVIDERS["build-kubernetes-diagram"]
+    components = [{"type": "pod", "name": f"pod-{i}"} for i in range(20)]
+    request = provider.request_model.model_validate(
+        {"components": components + [{"type": "service", "name": "svc"}], "format": "svg"}
+    )
+
+    source, _ = server._emit_dot(request, provider)
+
+    assert len(checks) == 1
+    assert len(staged) == 2
+    assert source.count(f'image="{stage_dir}') == 21
+
+
+def test_quote_always_parses():
+    assert server._quote("trailing\\") == '"trailing\\\\"'
+    assert server._quote("even\\\\") == '"even\\\\"'
+    assert server._quote("<b>html</b>") == '"<b>html</b>"'
+    assert server._quote("plain") == "plain"
+
+
+def test_read_png_stops_at_iend():
+    image = png_bytes()
+
+    async def read():
+        stream = stream_of(image + b"next")
+        return await server._read_png(stream), await stream.read()
+
+    assert asyncio.run(read()) == (image, b"next")
+
+
+def test_read_png_rejects_other_payloads():
+    async def read():
+        return await server._read_png(stream_of(b"Error: syntax error\n"))
+
+    with pytest.raises(ValueError):
+        asyncio.run(read())
+
+
+def test_read_png_truncated():
+    async def read():
+        return await server._read_png(stream_of(png_bytes()[:-4]))
+
+    with pytest.raises(asyncio.IncompleteReadError):
+        asyncio.run(read())
+
+
+def test_read_svg_stops_at_closing_tag():
+    first = b'<?xml version="1.0"?>\n<svg>\n<g/>\n</svg>\n'
+
+    async def read():
+        stream = stream_of(first + b"<svg>\n")
+        return await server._read_svg(stream), await stream.read()
+
+    assert asyncio.run(read()) == (first, b"<svg>\n")
+
+
+def test_inline_icons_embeds_each_icon_once():
+    classes = server.DIAGRAM_PROVIDERS["build-kubernetes-diagram"].classes()
+    deploy = server._packaged_icon_path(classes["deployment"])
+    service = server._packaged_icon_path(classes["service"])
+    images = "".join(
+        f'<image xlink:href="{path}" width="101px" height="101px" '
+        f'preserveAspectRatio="xMinYMin meet" x="{x}" y="-9"/>'
+        for x, path in enumerate([deploy, deploy, deploy, service])
+    )
+    svg = (
+        '<svg xmlns="http://www.w3.org/2000/svg" '
+        f'xmlns:xlink="http://www.w3.org/1999/xlink">\n{images}</svg>\n'
+    )
+
+    inlined = server._inline_icons(svg)
+
+    assert deploy not in inlined and service not in inlined
+    assert inlined.count("data:image/png;base64,iVBORw0KGgo") == 2
+    assert inlined.count('<use xlink:href="#icon-0" width="101px"') == 3
+    assert inlined.count('<use xlink:href="#icon-1"') == 1
+    symbol = '<symbol id="icon-0" viewBox="0 0 256 256" preserveAspectRatio="xMinYMin meet">'
+    assert symbol in inlined
+    ET.fromstring(inlined)
+
+
+def test_inline_icons_drops_unreadable_icons():
+    svg = '<svg><image xlink:href="/missing.png" width="1px"/></svg>'
+    assert server._inline_icons(svg) == "<svg></svg>"
+
+
+def test_unknown_connection_endpoint_rejected():
+    with pytest.raises(ValidationError, match="unknown components: db"):
+        server.AwsDiagramRequest.model_validate(
+            {
+                "components": [{"type": "ec2", "name": "web"}],
+                "connections": [{"from": "web", "to": "db"}],
+            }
+        )
+
+
+@pytest.mark.parametrize(
+    "arguments",
+    [
+        {"components": [{"type": "pod", "name": "api"}], "format": "jpeg"},
+        {"components": [{"type": "pod", "name": "api", "replicas": 2.5}]},
+        {"components": [{"type": "pod"}]},
+    ],
+)
+def test_invalid_arguments_rejected(arguments):
+    with pytest.raises(ValidationError):
+        asyncio.run(server.call_tool("build-kubernetes-diagram", arguments))
+
+
+def test_unknown_tool():
+    with pytest.raises(ValueError, match="Unknown tool"):
+        asyncio.run(server.call_tool("build-azure-diagram", {}))
+
+
+def test_no_components():
+    result = asyncio.run(server.call_tool("build-aws-diagram", {"name": "empty"}))
+    assert result == [TextContent(type="text", text="empty: no components specified")]
+
+
+def test_spec_hash_handles_large_integers():
+    arguments = {"components": [{"type": "pod", "name": "api", "replicas": 10**20}]}
+    assert len(server._spec_hash("build-kubernetes-diagram", arguments)) == 64
+
+
+def build(arguments: dict, renders: list) -> list:
+    """Run build-kubernetes-diagram, recording each render that misses the cache."""
+    async def run(func, *args):
+        renders.append(args)
+        return func(*args)
+
+    return asyncio.run(server._build_diagram("build-kubernetes-diagram", arguments, run))
+
+
+def test_cache_miss_then_hit(cache_dir):
+    arguments = dict(load_example("kubernetes_example.json"), format="dot")
+    renders = []
+
+    first = build(arguments, renders)
+    assert len(renders) == 1
+    assert len(list(cache_dir.glob("*.payload"))) == 1
+
+    second = build(arguments, renders)
+    assert len(renders) == 1
+    assert second == first
+
+    # A different spec is a miss
+    build(dict(arguments, name="other"), renders)
+    assert len(renders) == 2
+
+
+def test_cache_key_includes_versions(monkeypatch):
+    arguments = {"components": [{"type": "pod", "name": "api"}]}
+    before = server._spec_hash("build-kubernetes-diagram", arguments)
+    monkeypatch.setitem(server.RENDER_VERSIONS, "diagrams", "0.0.0")
+    assert server._spec_hash("build-kubernetes-diagram", arguments) != before
+
+
+def test_text_format_skips_cache(cache_dir):
+    renders = []
+    build({"components": [{"type": "pod", "name": "api"}], "format": "text"}, renders)
+    build({"components": [{"type": "pod", "name": "api"}], "format": "text"}, renders)
+    assert len(renders) == 2
+    assert not cache_dir.exists() or not list(cache_dir.iterdir())
+
+
+def test_cache_memo_bounded_by_size():
+    memo = server.CacheMemo(max_chars=10, max_entry_chars=6)
+    memo.put("a", ("ab", "cd"))
+    memo.put("b", ("ab", "cd"))
+    memo.put("huge", ("", "x" * 7))
+    assert memo.get("huge") is None
+    assert memo.get("a") == ("ab", "cd")
+    # Over the total bound, the least recently used entry goes first
+    memo.put("c", ("ab", "cd"))
+    assert memo.get("b") is None
+    assert memo.get("a") is not None and memo.get("c") is not None
+
+
+def test_cache_pruned(cache_dir, monkeypatch):
+    monkeypatch.setattr(server, "CACHE_MAX_ENTRIES", 2)
+    renders = []
+    for i in range(4):
+        build({"name": f"d{i}", "components": [{"type": "pod", "name": "api"}],
+               "format": "dot"}, renders)
+    assert len(list(cache_dir.glob("*.payload"))) == 2
+    assert len(list(cache_dir.glob("*.txt"))) == 2
+
+
+def test_unwritable_cache_still_renders(cache_dir):
+    cache_dir.write_text("not a directory")
+    renders = []
+    result = build({"components": [{"type": "pod", "name": "api"}], "format": "dot"}, renders)
+    assert len(renders) == 1
+    assert result[0].text.startswith("Kubernetes architecture diagram")
+
+
+def test_shared_cache_dir_ignored(cache_dir):
+    arguments = {"components": [{"type": "pod", "name": "api"}], "format": "dot"}
+    request = server.K8sDiagramRequest.model_validate(arguments)
+    spec_hash = server._spec_hash("build-kubernetes-diagram", request.model_dump(by_alias=True))
+    # Another user could have created the directory open to all and planted an entry
+    cache_dir.mkdir(mode=0o777)
+    cache_dir.chmod(0o777)
+    (cache_dir / f"{spec_hash}.txt").write_text("planted")
+    (cache_dir / f"{spec_hash}.payload").write_text("planted")
+
+    renders = []
+    result = build(arguments, renders)
+    assert len(renders) == 1
+    assert "planted" not in result[0].text
+    assert (cache_dir / f"{spec_hash}.payload").read_text() == "planted"
+
+
+def test_write_atomic_does_not_follow_symlinks(tmp_path):
+    target = tmp_path / "victim"
+    target.write_text("untouched")
+    entry = tmp_path / "entry.payload"
+    # A link at the partial name a pid/thread-id scheme would predict
+    Path(f"{entry}.{os.getpid()}.{threading.get_ident()}.tmp").symlink_to(target)
+
+    server._write_atomic(str(entry), "payload")
+
+    assert entry.read_text() == "payload"
+    assert target.read_text() == "untouched"
+    assert not [p for p in tmp_path.glob("*.tmp") if not p.is_symlink()]
+
+
+def test_batch_reports_every_invalid_entry():
+    diagrams_arg = [
+        {"tool": "build-aws-diagram", "arguments": {"components": [{"type": "ec2", "name": "a"}]}},
+        {"tool": "build-aws-diagram", "arguments": {
+            "components": [{"type": "ec2", "name": "a"}],
+            "connections": [{"from": "a", "to": "b"}],
+        }},
+        {"tool": "build-azure-diagram", "arguments": {}},
+    ]
+    with pytest.raises(ValueError) as excinfo:
+        asyncio.run(server.call_tool(server.BATCH_TOOL_NAME, {"diagrams": diagrams_arg}))
+    message = str(excinfo.value)
+    assert "diagrams[1] (build-aws-diagram)" in message and "unknown components: b" in message
+    assert "diagrams[2] (build-azure-diagram): Unknown tool" in message
+    assert "diagrams[0]" not in message
+
+
+def test_batch_keeps_results_when_one_render_fails(monkeypatch):
+    original = server._render
+
+    def render(request, provider):
+        if request.name == "broken":
+            raise RuntimeError("dot crashed")
+        return original(request, provider)
+
+    monkeypatch.setattr(server, "_render", render)
+    component = {"type": "pod", "name": "api"}
+    diagrams_arg = [
+        {"tool": "build-kubernetes-diagram",
+         "arguments": {"name": name, "components": [component], "format": "dot"}}
+        for name in ("first", "broken", "last")
+    ]
+
+    result = asyncio.run(server.call_tool(server.BATCH_TOOL_NAME, {"diagrams": diagrams_arg}))
+
+    texts = [content.text for content in result]
+    assert texts[0].startswith("Kubernetes architecture diagram 'first'")
+    assert "diagrams[1] (build-kubernetes-diagram): render failed: dot crashed" in texts
+    assert texts[-2].startswith("Kubernetes architecture diagram 'last'")
+
+
+# Stand-in for Graphviz's dot: like the real one it renders each graph as soon as it is
+# read from stdin. Every image is tagged with its pid and whether it came from a one-shot
+# graphviz.pipe (-K) call; graphs containing CRASH kill a persistent worker.
+STUB_DOT = r"""
+import os, struct, sys, zlib
+
+args = sys.argv[1:]
+fmt = next(arg[2:] for arg in args if arg.startswith("-T"))
+oneshot = any(arg.startswith("-K") for arg in args)
+
+
+def chunk(chunk_type, data):
+    crc = zlib.crc32(chunk_type + data) & 0xFFFFFFFF
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", crc)
+
+
+def render():
+    tag = f"{os.getpid()} {'oneshot' if oneshot else 'worker'}".encode()
+    if fmt == "png":
+        return (
+            b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 0, 0, 0, 0))
+            + chunk(b"tEXt", b"Comment\0" + tag)
+            + chunk(b"IDAT", zlib.compress(b"\0\0"))
+            + chunk(b"IEND", b"")
+        )
+    return b'<?xml version="1.0"?>\n<svg>\n<!-- ' + tag + b" -->\n</svg>\n"
+
+
+graph = []
+for line in sys.stdin:
+    graph.append(line)
+    if line == "}\n":
+        if "CRASH" in "".join(graph) and not oneshot:
+            sys.exit(1)
+        graph = []
+        sys.stdout.buffer.write(render())
+        sys.stdout.buffer.flush()
+"""
+
+GRAPH = "digraph g {\n\ta -> b\n}\n"
+CRASH_GRAPH = "digraph g {\n\tCRASH\n}\n"
+
+
+@pytest.fixture
+def stub_dot(tmp_path, monkeypatch):
+    """Put the stub dot first on PATH."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    dot = bin_dir / "dot"
+    dot.write_text(f"#!{sys.executable}\n{STUB_DOT}")
+    dot.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}")
+
+
+def image_tag(image: bytes) -> tuple[int, str]:
+    """Return the (pid, mode) the stub dot tagged an image with."""
+    pid, mode = re.search(rb"(\d+) (oneshot|worker)", image).groups()
+    return int(pid), mode.decode()
+
+
+@pytest.mark.parametrize("fmt", ["png", "svg"])
+def test_dot_worker_frames_consecutive_graphs(stub_dot, fmt):
+    async def render():
+        worker = server.DotWorker(fmt)
+        await worker.start()
+        try:
+            return [await worker.render(GRAPH) for _ in range(3)]
+        finally:
+            await worker.close()
+
+    images = asyncio.run(render())
+
+    # Each response is exactly one image, and all came from the same process
+    tags = {image_tag(image) for image in images}
+    assert len(tags) == 1 and tags.pop()[1] == "worker"
+    for image in images:
+        if fmt == "png":
+            assert image.startswith(server.PNG_SIGNATURE) and image.endswith(b"IEND\xaeB`\x82")
+        else:
+            assert image.startswith(b"<?xml") and image.endswith(b"</svg>\n")
+
+
+def test_dot_worker_respawns_after_failure(stub_dot):
+    async def render():
+        worker = server.DotWorker("svg")
+        await worker.start()
+        try:
+            first = await worker.render(GRAPH)
+            with pytest.raises(RuntimeError):
+                await worker.render(CRASH_GRAPH)
+            assert not worker.alive
+            return first, await worker.render(GRAPH)
+        finally:
+            await worker.close()
+
+    first, second = asyncio.run(render())
+    assert image_tag(first)[0] != image_tag(second)[0]
+
+
+def test_dot_worker_rejects_incomplete_graph(stub_dot):
+    async def render():
+        worker = server.DotWorker("svg")
+        await worker.start()
+        try:
+            with pytest.raises(RuntimeError):
+                await worker.render("digraph g {")
+            return await worker.render(GRAPH)
+        finally:
+            await worker.close()
+
+    assert image_tag(asyncio.run(render()))[1] == "worker"
+
+
+def test_dot_worker_pool_runs_renders_in_parallel(stub_dot):
+    async def render():
+        pool = server.DotWorkerPool("png", 2)
+        await pool.start()
+        try:
+            return await asyncio.gather(*(pool.render(GRAPH) for _ in range(6)))
+        finally:
+            await pool.close()
+
+    pids = {image_tag(image)[0] for image in asyncio.run(render())}
+    assert len(pids) == 2
+
+
+def test_render_image_hands_off_to_pool_and_falls_back(stub_dot, monkeypatch):
+    pools = {fmt: server.DotWorkerPool(fmt, 2) for fmt in ("png", "svg")}
+    monkeypatch.setattr(server, "dot_pools", pools)
+
+    async def render():
+        for pool in pools.values():
+            await pool.start()
+        try:
+            # Called from renderer threads, as _render does
+            images = await asyncio.gather(
+                asyncio.to_thread(server.render_image, GRAPH, "svg"),
+                asyncio.to_thread(server.render_image, GRAPH, "png"),
+                asyncio.to_thread(server.render_image, CRASH_GRAPH, "svg"),
+            )
+            return images, await asyncio.to_thread(server.render_image, GRAPH, "svg")
+        finally:
+            for pool in pools.values():
+                await pool.close()
+
+    (svg, png, crashed), after = asyncio.run(render())
+    assert image_tag(svg)[1] == "worker" and image_tag(png)[1] == "worker"
+    assert png.startswith(server.PNG_SIGNATURE)
+    # The failed worker render was retried as a one-shot graphviz.pipe
+    assert image_tag(crashed)[1] == "oneshot"
+    assert image_tag(after)[1] == "worker"
+
+
+def test_render_image_without_pool_uses_one_shot(stub_dot):
+    # As in processes that never started the pools
+    assert image_tag(server.render_image(GRAPH, "png"))[1] == "oneshot"
+
+
+def test_build_diagram_renders_svg_through_workers(stub_dot, monkeypatch):
+    pools = {fmt: server.DotWorkerPool(fmt, 1) for fmt in ("png", "svg")}
+    monkeypatch.setattr(server, "dot_pools", pools)
+    arguments = load_example("kubernetes_example.json")
+
+    async def build_svg():
+        for pool in pools.values():
+            await pool.start()
+        try:
+            return await server.call_tool("build-kubernetes-diagram", arguments)
+        finally:
+            for pool in pools.values():
+                await pool.close()
+
+    text, resource = asyncio.run(build_svg())
+    assert text.text.endswith("with 15 components.")
+    assert resource.resource.mimeType == "image/svg+xml"
+    assert image_tag(resource.resource.text.encode())[1] == "worker"
+
+
+@pytest.mark.skipif(shutil.which("dot") is None, reason="Graphviz dot is not installed")
+@pytest.mark.parametrize("fmt", ["png", "svg"])
+def test_dot_worker_renders_consecutive_graphs(fmt):
+    provider = server.DIAGRAM_PROVIDERS["build-kubernetes-diagram"]
+    request = provider.request_model.model_validate(load_example("kubernetes_example.json"))
+    source, _ = server._emit_dot(request, provider)
+
+    async def render():
+        worker = server.DotWorker(fmt)
+        await worker.start()
+        try:
+            first = await worker.render(source)
+            # A retired worker is respawned on the next render
+            worker._kill()
+            second = await worker.render(source)
+            return first, second, worker.alive
+        finally:
+            await worker.close()
+
+    first, second, alive = asyncio.run(render())
+    assert alive
+    marker = server.PNG_SIGNATURE if fmt == "png" else b"<svg"
+    assert marker in first and marker in second